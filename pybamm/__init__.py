@@ -218,7 +218,7 @@ from .solvers.scipy_solver import ScipySolver
 # Jax not supported under windows
 if system() != "Windows":
     from .solvers.jax_solver import JaxSolver
-    from .solvers.jax_bdf_solver import jax_bdf_integrate
+    from .solvers.jax_bdf_solver import jax_bdf_integrate, jax_bdf_integrate_batched
 
 from .solvers.idaklu_solver import IDAKLUSolver, have_idaklu
 
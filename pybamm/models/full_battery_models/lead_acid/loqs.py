@@ -59,24 +59,19 @@ class LOQS(BaseModel):
         Define how the external circuit defines the boundary conditions for the model,
         e.g. (not necessarily constant-) current, voltage, etc
         """
-        if self.options["operating mode"] == "current":
-            self.submodels[
-                "leading order external circuit"
-            ] = pybamm.external_circuit.LeadingOrderCurrentControl(self.param)
-        elif self.options["operating mode"] == "voltage":
-            self.submodels[
-                "leading order external circuit"
-            ] = pybamm.external_circuit.LeadingOrderVoltageFunctionControl(self.param)
-        elif self.options["operating mode"] == "power":
-            self.submodels[
-                "leading order external circuit"
-            ] = pybamm.external_circuit.LeadingOrderPowerFunctionControl(self.param)
-        elif callable(self.options["operating mode"]):
-            self.submodels[
-                "leading order external circuit"
-            ] = pybamm.external_circuit.LeadingOrderFunctionControl(
-                self.param, self.options["operating mode"]
+        operating_mode = self.options["operating mode"]
+        if callable(operating_mode):
+            submodel = pybamm.external_circuit.LeadingOrderFunctionControl(
+                self.param, operating_mode
             )
+        else:
+            # the operating mode has already been validated by the options setter
+            submodel = {
+                "current": pybamm.external_circuit.LeadingOrderCurrentControl,
+                "voltage": pybamm.external_circuit.LeadingOrderVoltageFunctionControl,
+                "power": pybamm.external_circuit.LeadingOrderPowerFunctionControl,
+            }[operating_mode](self.param)
+        self.submodels["leading order external circuit"] = submodel
 
     def set_current_collector_submodel(self):
 
@@ -109,24 +104,19 @@ class LOQS(BaseModel):
     def set_convection_submodel(self):
 
         if self.options["convection"] is False:
-            self.submodels[
-                "leading-order transverse convection"
-            ] = pybamm.convection.transverse.NoConvection(self.param)
-            self.submodels[
-                "leading-order through-cell convection"
-            ] = pybamm.convection.through_cell.NoConvection(self.param)
+            transverse = pybamm.convection.transverse.NoConvection
+            through_cell = pybamm.convection.through_cell.NoConvection
         else:
-            if self.options["convection"] == "uniform transverse":
-                self.submodels[
-                    "leading-order transverse convection"
-                ] = pybamm.convection.transverse.Uniform(self.param)
-            elif self.options["convection"] == "full transverse":
-                self.submodels[
-                    "leading-order transverse convection"
-                ] = pybamm.convection.transverse.Full(self.param)
-            self.submodels[
-                "leading-order through-cell convection"
-            ] = pybamm.convection.through_cell.Explicit(self.param)
+            transverse = {
+                "uniform transverse": pybamm.convection.transverse.Uniform,
+                "full transverse": pybamm.convection.transverse.Full,
+            }[self.options["convection"]]
+            through_cell = pybamm.convection.through_cell.Explicit
+
+        self.submodels["leading-order transverse convection"] = transverse(self.param)
+        self.submodels["leading-order through-cell convection"] = through_cell(
+            self.param
+        )
 
     def set_interfacial_submodel(self):
 
@@ -191,17 +181,15 @@ class LOQS(BaseModel):
                 "leading-order electrolyte conductivity"
             ] = pybamm.electrolyte_conductivity.LeadingOrder(self.param)
 
-        elif self.options["surface form"] == "differential":
-            for domain in ["Negative", "Separator", "Positive"]:
-                self.submodels[
-                    "leading-order " + domain.lower() + " electrolyte conductivity"
-                ] = surf_form.LeadingOrderDifferential(self.param, domain)
-
-        elif self.options["surface form"] == "algebraic":
+        else:
+            submodel = {
+                "differential": surf_form.LeadingOrderDifferential,
+                "algebraic": surf_form.LeadingOrderAlgebraic,
+            }[self.options["surface form"]]
             for domain in ["Negative", "Separator", "Positive"]:
                 self.submodels[
                     "leading-order " + domain.lower() + " electrolyte conductivity"
-                ] = surf_form.LeadingOrderAlgebraic(self.param, domain)
+                ] = submodel(self.param, domain)
 
         self.submodels[
             "electrolyte diffusion"
@@ -1,6 +1,7 @@
 import operator as op
 import numpy as onp
 import collections
+import functools
 
 import jax
 import jax.numpy as jnp
@@ -9,7 +10,7 @@ from jax import dtypes
 from jax.util import safe_map, cache, split_list
 from jax.api_util import flatten_fun_nokwargs
 from jax.flatten_util import ravel_pytree
-from jax.tree_util import tree_map, tree_flatten, tree_unflatten, tree_multimap, partial
+from jax.tree_util import tree_map, tree_flatten, tree_unflatten
 from jax.interpreters import partial_eval as pe
 from jax import linear_util as lu
 from jax.config import config
@@ -22,9 +23,43 @@ ROOT_SOLVE_MAXITER = 15
 MIN_FACTOR = 0.2
 MAX_FACTOR = 10
 
+# the NDF coefficients only depend on MAX_ORDER, so are calculated once here using numpy
+# rather than being traced on every solve and carried in the solver state.
+# kappa values for difference orders, taken from Table 1 of [1]
+KAPPA = onp.array([0, -0.1850, -1 / 9, -0.0823, -0.0415, 0])
+GAMMA = onp.hstack((0, onp.cumsum(1 / onp.arange(1, MAX_ORDER + 1))))
+with onp.errstate(divide='ignore'):
+    # ALPHA[0] = inf, but order 0 is never used
+    ALPHA = 1.0 / ((1 - KAPPA) * GAMMA)
+ERROR_CONST = KAPPA * GAMMA + 1 / onp.arange(1, MAX_ORDER + 2)
 
-@jax.partial(jax.custom_vjp, nondiff_argnums=(0, 1, 2, 3))
-def _bdf_odeint(fun, mass, rtol, atol, y0, t_eval, *args):
+# indices of the rows of the differences array D, used to mask out the differences
+# above the current order
+ORDER_INDICES = onp.arange(MAX_ORDER + 1)
+
+
+@functools.lru_cache(maxsize=8)
+def _identity(n, dtype):
+    """
+    returns the n x n identity matrix as a numpy array, cached by size and dtype so
+    that repeated solves of the same system reuse it. It is shared between calls, so
+    is made read-only
+    """
+    identity = onp.identity(n, dtype=dtype)
+    identity.flags.writeable = False
+    return identity
+
+
+@functools.lru_cache(maxsize=8)
+def _diag_indices(n):
+    """
+    returns the indices of the diagonal of an n x n matrix, cached by size
+    """
+    return onp.diag_indices(n)
+
+
+@jax.partial(jax.custom_vjp, nondiff_argnums=(0, 1, 2))
+def _bdf_odeint(fun, mass, jac_sparsity, rtol, atol, y0, t_eval, *args):
     """
     This implements a Backward Difference formula (BDF) implicit multistep integrator.
     The basic algorithm is derived in [2]_. This particular implementation follows that
@@ -43,6 +78,9 @@ def _bdf_odeint(fun, mass, rtol, atol, y0, t_eval, *args):
         `t` as `func(y, t, *args)`, producing the same shape/structure as `y0`.
     mass: ndarray
         diagonal of the mass matrix with shape (n,)
+    jac_sparsity: tuple or None
+        sparsity pattern of the jacobian of `func` with respect to `y`, as a hashable
+        key created by _sparsity_key. If None the jacobian is treated as dense
     y0: ndarray
         initial state vector, has shape (n,)
     t_eval: ndarray
@@ -77,7 +115,12 @@ def _bdf_odeint(fun, mass, rtol, atol, y0, t_eval, *args):
     def fun_bind_inputs(y, t):
         return fun(y, t, *args)
 
-    jac_bind_inputs = jax.jacfwd(fun_bind_inputs, argnums=0)
+    if jac_sparsity is None:
+        jac_bind_inputs = jax.jacfwd(fun_bind_inputs, argnums=0)
+    else:
+        jac_bind_inputs = _sparse_jacfwd(
+            fun_bind_inputs, _sparsity_from_key(jac_sparsity)
+        )
 
     t0 = t_eval[0]
     h0 = t_eval[1] - t0
@@ -88,53 +131,61 @@ def _bdf_odeint(fun, mass, rtol, atol, y0, t_eval, *args):
     i = 0
     y_out = jnp.empty((len(t_eval), len(y0)), dtype=y0.dtype)
 
-    init_state = [stepper, t_eval, i, y_out]
+    # t_eval is constant so is not carried through the loop
+    init_state = [stepper, i, y_out]
 
     def cond_fun(state):
-        _, t_eval, i, _ = state
+        _, i, _ = state
         return i < len(t_eval)
 
     def body_fun(state):
-        stepper, t_eval, i, y_out = state
+        stepper, i, y_out = state
         stepper = _bdf_step(stepper, fun_bind_inputs, jac_bind_inputs)
-        index = jnp.searchsorted(t_eval, stepper.t)
 
-        def for_body(j, y_out):
-            t = t_eval[j]
-            y_out = jax.ops.index_update(y_out, jax.ops.index[j, :],
-                                         _bdf_interpolate(stepper, t))
-            return y_out
+        # time only moves forwards, so rather than searching all of t_eval the output
+        # cursor is advanced from its previous position past the output times
+        # passed during this step. Each of these is interpolated and written as the
+        # cursor passes it, so the work per step is proportional to the number of
+        # output times passed
+        def passed_output_time(state):
+            index, _ = state
+            return jnp.logical_and(
+                index < len(t_eval),
+                t_eval[jnp.minimum(index, len(t_eval) - 1)] < stepper.t
+            )
 
-        y_out = jax.lax.fori_loop(i, index, for_body, y_out)
-        return [stepper, t_eval, index, y_out]
+        def write_output(state):
+            index, y_out = state
+            y_out = y_out.at[index].set(_bdf_interpolate(stepper, t_eval[index]))
+            return index + 1, y_out
 
-    stepper, t_eval, i, y_out = jax.lax.while_loop(cond_fun, body_fun,
-                                                   init_state)
+        index, y_out = jax.lax.while_loop(
+            passed_output_time, write_output, (i, y_out)
+        )
+        return [stepper, index, y_out]
+
+    stepper, i, y_out = jax.lax.while_loop(cond_fun, body_fun, init_state)
     return y_out
 
 
 BDFInternalStates = [
     't', 'atol', 'rtol', 'M', 'newton_tol', 'order', 'h', 'n_equal_steps', 'D',
-    'y0', 'scale_y0', 'kappa', 'gamma', 'alpha', 'c', 'error_const', 'J', 'LU', 'U',
+    'y0', 'scale_y0', 'c', 'J', 'LU',
     'psi', 'n_function_evals', 'n_jacobian_evals', 'n_lu_decompositions', 'n_steps',
     'consistent_y0_failed'
 ]
+# namedtuples are pytrees, so the solver state can be passed through jax control flow
+# directly and each field is accessed by name at trace time
 BDFState = collections.namedtuple('BDFState', BDFInternalStates)
 
-jax.tree_util.register_pytree_node(
-    BDFState,
-    lambda xs: (tuple(xs), None),
-    lambda _, xs: BDFState(*xs)
-)
-
 
 def _bdf_init(fun, jac, mass, t0, y0, h0, rtol, atol):
     """
     Initiation routine for Backward Difference formula (BDF) implicit multistep
     integrator.
 
-    See _bdf_odeint function above for details, this function returns a dict with the
-    initial state of the solver
+    See _bdf_odeint function above for details, this function returns a BDFState with
+    the initial state of the solver
 
     Parameters
     ----------
@@ -160,62 +211,137 @@ def _bdf_init(fun, jac, mass, t0, y0, h0, rtol, atol):
         absolute tolerance for the solver
     """
 
-    state = {}
-    state['t'] = t0
-    state['atol'] = atol
-    state['rtol'] = rtol
-    state['M'] = mass
+    # the mass matrix is static, so if it is diagonal (as for the default identity mass
+    # matrix, or a finite volume discretisation) only its diagonal is stored, and
+    # products with M in the newton iteration become elementwise
+    if _is_diagonal(mass):
+        M = onp.diag(mass)
+    else:
+        M = mass
     EPS = jnp.finfo(y0.dtype).eps
-    state['newton_tol'] = jnp.max((10 * EPS / rtol, jnp.min((0.03, rtol ** 0.5))))
+    newton_tol = jnp.max((10 * EPS / rtol, jnp.min((0.03, rtol ** 0.5))))
 
     scale_y0 = atol + rtol * jnp.abs(y0)
     y0, not_converged = _select_initial_conditions(
-        fun, mass, t0, y0, state['newton_tol'], scale_y0
+        fun, mass, t0, y0, newton_tol, scale_y0
     )
-    state['consistent_y0_failed'] = not_converged
 
     f0 = fun(y0, t0)
+    # scale of the consistent initial conditions
+    scale_y0 = atol + rtol * jnp.abs(y0)
     order = 1
-    state['order'] = order
-    state['h'] = _select_initial_step(atol, rtol, fun, t0, y0, f0, h0)
-    state['n_equal_steps'] = 0
-    D = jnp.empty((MAX_ORDER + 1, len(y0)), dtype=y0.dtype)
-    D = jax.ops.index_update(D, jax.ops.index[0, :], y0)
-    D = jax.ops.index_update(D, jax.ops.index[1, :], f0 * state['h'])
-    state['D'] = D
-    state['y0'] = y0
-    state['scale_y0'] = scale_y0
-
-    # kappa values for difference orders, taken from Table 1 of [1]
-    kappa = jnp.array([0, -0.1850, -1 / 9, -0.0823, -0.0415, 0])
-    gamma = jnp.hstack((0, jnp.cumsum(1 / jnp.arange(1, MAX_ORDER + 1))))
-    alpha = 1.0 / ((1 - kappa) * gamma)
-    c = state['h'] * alpha[order]
-    error_const = kappa * gamma + 1 / jnp.arange(1, MAX_ORDER + 2)
-
-    state['kappa'] = kappa
-    state['gamma'] = gamma
-    state['alpha'] = alpha
-    state['c'] = c
-    state['error_const'] = error_const
+    h = _select_initial_step(fun, t0, y0, f0, h0, scale_y0)
+    D = jnp.zeros((MAX_ORDER + 1, len(y0)), dtype=y0.dtype)
+    D = D.at[0, :].set(y0)
+    D = D.at[1, :].set(f0 * h)
 
+    c = h * ALPHA[order]
     J = jac(y0, t0)
-    state['J'] = J
+    LU = jax.scipy.linalg.lu_factor(_newton_matrix(M, c, J))
+
+    state = BDFState(
+        t=t0, atol=atol, rtol=rtol, M=M, newton_tol=newton_tol, order=order, h=h,
+        n_equal_steps=0, D=D, y0=y0, scale_y0=scale_y0, c=c, J=J, LU=LU, psi=None,
+        n_function_evals=2, n_jacobian_evals=1, n_lu_decompositions=1, n_steps=0,
+        consistent_y0_failed=not_converged
+    )
+    y0, scale_y0, psi = _predict_and_update_psi(state, D)
+    return state._replace(y0=y0, scale_y0=scale_y0, psi=psi)
 
-    state['LU'] = jax.scipy.linalg.lu_factor(state['M'] - c * J)
 
-    state['U'] = _compute_R(order, 1)
-    state['psi'] = None
+def _color_columns(sparsity):
+    """
+    greedy colouring of the columns of the boolean matrix `sparsity`, such that no
+    two columns with the same colour have a nonzero in the same row
+    """
+    colors = onp.empty(sparsity.shape[1], dtype=int)
+    # rows already used by each colour
+    color_rows = []
+    for j, rows in enumerate(sparsity.T):
+        for color, used_rows in enumerate(color_rows):
+            if not onp.any(used_rows & rows):
+                used_rows |= rows
+                break
+        else:
+            color = len(color_rows)
+            color_rows.append(rows.copy())
+        colors[j] = color
+    return colors
 
-    state['n_function_evals'] = 2
-    state['n_jacobian_evals'] = 1
-    state['n_lu_decompositions'] = 1
-    state['n_steps'] = 0
 
-    tuple_state = BDFState(*[state[k] for k in BDFInternalStates])
-    y0, scale_y0 = _predict(tuple_state, D)
-    psi = _update_psi(tuple_state, D)
-    return tuple_state._replace(y0=y0, scale_y0=scale_y0, psi=psi)
+def _sparsity_key(sparsity):
+    """
+    returns a hashable key for the boolean matrix `sparsity`. The sparsity pattern is
+    a static argument of the compiled solver, and arrays are not hashable, so this is
+    passed instead so that equal patterns reuse the same compiled solver
+    """
+    sparsity = onp.asarray(sparsity, dtype=bool)
+    rows, cols = onp.nonzero(sparsity)
+    return sparsity.shape, tuple(rows.tolist()), tuple(cols.tolist())
+
+
+def _sparsity_from_key(key):
+    """
+    returns the boolean matrix for a key created by _sparsity_key
+    """
+    shape, rows, cols = key
+    sparsity = onp.zeros(shape, dtype=bool)
+    sparsity[list(rows), list(cols)] = True
+    return sparsity
+
+
+def _sparse_jacfwd(fun, sparsity):
+    """
+    returns a function that calculates the jacobian of fun(y, t) with respect to y,
+    as per jax.jacfwd(fun, argnums=0), but uses the known sparsity pattern of
+    the jacobian to do so.
+
+    Columns of the jacobian with the same colour (see _color_columns) share a seed
+    vector, so the jacobian is calculated using one forward mode jvp per colour rather
+    than one per column. For the banded jacobians of finite volume models the number
+    of colours is of the order of the bandwidth, independent of n.
+    """
+    sparsity = onp.asarray(sparsity, dtype=bool)
+    colors = _color_columns(sparsity)
+    seeds = onp.zeros((colors.max() + 1, sparsity.shape[1]))
+    seeds[colors, onp.arange(sparsity.shape[1])] = 1
+    rows, cols = onp.nonzero(sparsity)
+
+    def jac(y, t):
+        def jvp(seed):
+            return jax.jvp(lambda y: fun(y, t), (y,), (seed,))[1]
+
+        # each row of compressed holds the sum of the columns of a single colour
+        compressed = jax.vmap(jvp)(seeds.astype(y.dtype))
+        J = jnp.zeros(sparsity.shape, dtype=y.dtype)
+        return J.at[rows, cols].set(compressed[colors[cols], rows])
+
+    return jac
+
+
+def _is_diagonal(M):
+    return onp.count_nonzero(M - onp.diag(onp.diagonal(M))) == 0
+
+
+def _mass_dot(M, x):
+    """
+    product of the mass matrix with x, where M is either the full mass matrix or a
+    vector holding the diagonal of a diagonal mass matrix
+    """
+    if M.ndim == 1:
+        return M * x
+    return M @ x
+
+
+def _newton_matrix(M, c, J):
+    """
+    calculates M - c * J, the matrix factorised for the newton iteration, where M is
+    stored as in _mass_dot
+    """
+    if M.ndim == 1:
+        # add the diagonal in place rather than materialising a dense diag(M)
+        return (-c * J).at[_diag_indices(M.shape[0])].add(M)
+    return M - c * J
 
 
 def _compute_R(order, factor):
@@ -229,17 +355,33 @@ def _compute_R(order, factor):
     Note that the U matrix also defined in the same section can be also be
     found using factor = 1, which corresponds to R with a constant step size
     """
-    I = jnp.arange(1, MAX_ORDER + 1).reshape(-1, 1)
-    J = jnp.arange(1, MAX_ORDER + 1)
-    M = jnp.empty((MAX_ORDER + 1, MAX_ORDER + 1))
-    M = jax.ops.index_update(M, jax.ops.index[1:, 1:],
-                             (I - 1 - factor * J) / I)
-    M = jax.ops.index_update(M, jax.ops.index[0], 1)
+    I = ORDER_INDICES[1:].reshape(-1, 1)
+    J = ORDER_INDICES[1:]
+    M = jnp.zeros((MAX_ORDER + 1, MAX_ORDER + 1))
+    M = M.at[1:, 1:].set((I - 1 - factor * J) / I)
+    M = M.at[0].set(1)
     R = jnp.cumprod(M, axis=0)
 
     return R
 
 
+def _compute_U():
+    """
+    computes the U matrix, which is the R matrix above with factor = 1. This only
+    depends on MAX_ORDER, so is calculated once on import using numpy rather than
+    being traced and stored in the solver state
+    """
+    I = onp.arange(1, MAX_ORDER + 1).reshape(-1, 1)
+    J = onp.arange(1, MAX_ORDER + 1)
+    M = onp.zeros((MAX_ORDER + 1, MAX_ORDER + 1))
+    M[1:, 1:] = (I - 1 - J) / I
+    M[0] = 1
+    return onp.cumprod(M, axis=0)
+
+
+U = _compute_U()
+
+
 def _select_initial_conditions(fun, M, t0, y0, tol, scale_y0):
     # identify algebraic variables as zeros on diagonal
     algebraic_variables = jnp.diag(M == 0.)
@@ -257,69 +399,68 @@ def _select_initial_conditions(fun, M, t0, y0, tol, scale_y0):
 
     # calculate fun_a, function of algebraic variables
     def fun_a(y_a):
-        y_full = jax.ops.index_update(y0, algebraic_variables, y_a)
+        y_full = y0.at[algebraic_variables].set(y_a)
         return fun(y_full, t0)[algebraic_variables]
 
     y0_a = y0[algebraic_variables]
-    scale_y0_a = scale_y0[algebraic_variables]
+    # scale is constant over the iteration, so invert it once here
+    inv_scale_y0_a = 1 / scale_y0[algebraic_variables]
 
     d = jnp.zeros(y0_a.shape[0], dtype=y0.dtype)
-    y_a = jnp.array(y0_a, copy=True)
 
     # calculate neg jacobian of fun_a
-    J_a = jax.jacfwd(fun_a)(y_a)
+    J_a = jax.jacfwd(fun_a)(y0_a)
     LU = jax.scipy.linalg.lu_factor(-J_a)
 
     converged = False
     dy_norm_old = -1.0
     k = 0
-    while_state = [k, converged, dy_norm_old, d, y_a]
+    # y_a = y0_a + d, so is not carried through the loop
+    while_state = [k, converged, dy_norm_old, d]
 
     def while_cond(while_state):
-        k, converged, _, _, _ = while_state
+        k, converged, _, _ = while_state
         return (converged == False) * (k < ROOT_SOLVE_MAXITER)  # noqa: E712
 
     def while_body(while_state):
-        k, converged, dy_norm_old, d, y_a = while_state
-        f_eval = fun_a(y_a)
+        k, converged, dy_norm_old, d = while_state
+        f_eval = fun_a(y0_a + d)
         dy = jax.scipy.linalg.lu_solve(LU, f_eval)
-        dy_norm = jnp.sqrt(jnp.mean((dy / scale_y0_a)**2))
+        dy_norm = jnp.sqrt(jnp.mean((dy * inv_scale_y0_a)**2))
         rate = dy_norm / dy_norm_old
 
         d += dy
-        y_a = y0_a + d
 
         # if converged then break out of iteration early
-        pred = dy_norm_old >= 0.
-        pred *= rate / (1 - rate) * dy_norm < tol
-        converged = (dy_norm == 0.) + pred
+        pred = jnp.logical_and(dy_norm_old >= 0., rate / (1 - rate) * dy_norm < tol)
+        converged = jnp.logical_or(dy_norm == 0., pred)
 
         dy_norm_old = dy_norm
 
-        return [k + 1, converged, dy_norm_old, d, y_a]
+        return [k + 1, converged, dy_norm_old, d]
 
-    k, converged, dy_norm_old, d, y_a = jax.lax.while_loop(while_cond,
-                                                           while_body,
-                                                           while_state)
-    y_tilde = jax.ops.index_update(y0, algebraic_variables, y_a)
+    k, converged, dy_norm_old, d = jax.lax.while_loop(while_cond,
+                                                      while_body,
+                                                      while_state)
+    y_tilde = y0.at[algebraic_variables].set(y0_a + d)
 
     return y_tilde, converged
 
 
-def _select_initial_step(atol, rtol, fun, t0, y0, f0, h0):
+def _select_initial_step(fun, t0, y0, f0, h0, scale):
     """
     Select a good initial step by stepping forward one step of forward euler, and
     comparing the predicted state against that using the provided function.
 
     Optimal step size based on the selected order is obtained using formula (4.12)
-    in [1]
+    in [1], with the error measured using the rms norm scaled by scale = atol + rtol *
+    abs(y0)
 
     References
     ----------
     .. [1] E. Hairer, S. P. Norsett G. Wanner, "Solving Ordinary Differential
                Equations I: Nonstiff Problems", Sec. II.4.
     """
-    scale = atol + jnp.abs(y0) * rtol
     y1 = y0 + h0 * f0
     f1 = fun(y1, t0 + h0)
     d2 = jnp.sqrt(jnp.mean(((f1 - f0) / scale)**2))
@@ -328,34 +469,23 @@ def _select_initial_step(atol, rtol, fun, t0, y0, f0, h0):
     return jnp.min((100 * h0, h1))
 
 
-def _predict(state, D):
+def _predict_and_update_psi(state, D):
     """
-    predict forward to new step (eq 2 in [1])
+    predict forward to new step (eq 2 in [1]) and update psi term as defined in second
+    equation on page 9 of [1]. Both only use the first order + 1 differences in D, so
+    they are calculated together using a single mask
     """
-    n = len(state.y0)
     order = state.order
-    orders = jnp.repeat(jnp.arange(MAX_ORDER + 1).reshape(-1, 1), n, axis=1)
-    subD = jnp.where(orders <= order, D, 0)
+    mask = ORDER_INDICES <= order
+    # mask broadcasts against the (MAX_ORDER + 1, n) shape of D
+    subD = jnp.where(mask.reshape(-1, 1), D, 0)
     y0 = jnp.sum(subD, axis=0)
     scale_y0 = state.atol + state.rtol * jnp.abs(state.y0)
-    return y0, scale_y0
 
-
-def _update_psi(state, D):
-    """
-    update psi term as defined in second equation on page 9 of [1]
-    """
-    order = state.order
-    n = len(state.y0)
-    orders = jnp.arange(MAX_ORDER + 1)
-    subGamma = jnp.where(orders > 0, jnp.where(orders <= order, state.gamma, 0), 0)
-    orders = jnp.repeat(orders.reshape(-1, 1), n, axis=1)
-    subD = jnp.where(orders > 0, jnp.where(orders <= order, D, 0), 0)
-    psi = jnp.dot(
-        subD.T,
-        subGamma
-    ) * state.alpha[order]
-    return psi
+    # note gamma[0] = 0, so D[0] does not contribute to psi
+    subGamma = jnp.where(mask, GAMMA, 0)
+    psi = jnp.dot(subD.T, subGamma) * jnp.asarray(ALPHA)[order]
+    return y0, scale_y0, psi
 
 
 def _update_difference_for_next_step(state, d):
@@ -373,10 +503,8 @@ def _update_difference_for_next_step(state, d):
     """
     order = state.order
     D = state.D
-    D = jax.ops.index_update(D, jax.ops.index[order + 2],
-                             d - D[order + 1])
-    D = jax.ops.index_update(D, jax.ops.index[order + 1],
-                             d)
+    D = D.at[order + 2].set(d - D[order + 1])
+    D = D.at[order + 1].set(d)
     i = order
     while_state = [i, D]
 
@@ -386,8 +514,7 @@ def _update_difference_for_next_step(state, d):
 
     def while_body(while_state):
         i, D = while_state
-        D = jax.ops.index_add(D, jax.ops.index[i],
-                              D[i + 1])
+        D = D.at[i].add(D[i + 1])
         i -= 1
         return [i, D]
 
@@ -400,7 +527,7 @@ def _update_step_size_and_lu(state, factor):
     state = _update_step_size(state, factor)
 
     # redo lu (c has changed)
-    LU = jax.scipy.linalg.lu_factor(state.M - state.c * state.J)
+    LU = jax.scipy.linalg.lu_factor(_newton_matrix(state.M, state.c, state.J))
     n_lu_decompositions = state.n_lu_decompositions + 1
 
     return state._replace(LU=LU, n_lu_decompositions=n_lu_decompositions)
@@ -418,26 +545,22 @@ def _update_step_size(state, factor):
     order = state.order
     h = state.h * factor
     n_equal_steps = 0
-    c = h * state.alpha[order]
+    c = h * jnp.asarray(ALPHA)[order]
 
     # update D using equations in section 3.2 of [1]
-    RU = _compute_R(order, factor).dot(state.U)
-    I = jnp.arange(0, MAX_ORDER + 1).reshape(-1, 1)
-    J = jnp.arange(0, MAX_ORDER + 1)
+    RU = _compute_R(order, factor).dot(U)
+    I = ORDER_INDICES.reshape(-1, 1)
+    J = ORDER_INDICES
 
     # only update order+1, order+1 entries of D
     RU = jnp.where(jnp.logical_and(I <= order, J <= order),
-                   RU, jnp.identity(MAX_ORDER + 1))
+                   RU, _identity(MAX_ORDER + 1, RU.dtype))
     D = state.D
     D = jnp.dot(RU.T, D)
-    # D = jax.ops.index_update(D, jax.ops.index[:order + 1],
-    #                         jnp.dot(RU.T, D[:order + 1]))
-
-    # update psi (D has changed)
-    psi = _update_psi(state, D)
+    # D = D.at[:order + 1].set(jnp.dot(RU.T, D[:order + 1]))
 
-    # update y0 (D has changed)
-    y0, scale_y0 = _predict(state, D)
+    # update y0 and psi (D has changed)
+    y0, scale_y0, psi = _predict_and_update_psi(state, D)
 
     return state._replace(n_equal_steps=n_equal_steps,
                           h=h, c=c,
@@ -451,7 +574,7 @@ def _update_jacobian(state, jac):
     """
     J = jac(state.y0, state.t + state.h)
     n_jacobian_evals = state.n_jacobian_evals + 1
-    LU = jax.scipy.linalg.lu_factor(state.M - state.c * J)
+    LU = jax.scipy.linalg.lu_factor(_newton_matrix(state.M, state.c, J))
     n_lu_decompositions = state.n_lu_decompositions + 1
     return state._replace(J=J, n_jacobian_evals=n_jacobian_evals, LU=LU,
                           n_lu_decompositions=n_lu_decompositions)
@@ -464,53 +587,55 @@ def _newton_iteration(state, fun):
     y0 = state.y0
     LU = state.LU
     M = state.M
-    scale_y0 = state.scale_y0
+    # scale is constant over the iteration, so invert it once here
+    inv_scale_y0 = 1 / state.scale_y0
     t = state.t + state.h
     d = jnp.zeros(y0.shape, dtype=y0.dtype)
-    y = jnp.array(y0, copy=True)
     n_function_evals = state.n_function_evals
 
     converged = False
     dy_norm_old = -1.0
     k = 0
-    while_state = [k, converged, dy_norm_old, d, y, n_function_evals]
+    # y = y0 + d, so is not carried through the loop
+    while_state = [k, converged, dy_norm_old, d, n_function_evals]
 
     def while_cond(while_state):
-        k, converged, _, _, _, _ = while_state
+        k, converged, _, _, _ = while_state
         return (converged == False) * (k < NEWTON_MAXITER)  # noqa: E712
 
     def while_body(while_state):
-        k, converged, dy_norm_old, d, y, n_function_evals = while_state
-        f_eval = fun(y, t)
+        k, converged, dy_norm_old, d, n_function_evals = while_state
+        f_eval = fun(y0 + d, t)
         n_function_evals += 1
-        b = c * f_eval - M @ (psi + d)
+        b = c * f_eval - _mass_dot(M, psi + d)
         dy = jax.scipy.linalg.lu_solve(LU, b)
-        dy_norm = jnp.sqrt(jnp.mean((dy / scale_y0)**2))
+        dy_norm = jnp.sqrt(jnp.mean((dy * inv_scale_y0)**2))
         rate = dy_norm / dy_norm_old
 
         # if iteration is not going to converge in NEWTON_MAXITER
         # (assuming the current rate), then abort
-        pred = rate >= 1
-        pred += rate ** (NEWTON_MAXITER - k) / (1 - rate) * dy_norm > tol
-        pred *= dy_norm_old >= 0
-        k += pred * (NEWTON_MAXITER - k - 1)
+        pred = jnp.logical_or(
+            rate >= 1,
+            rate ** (NEWTON_MAXITER - k) / (1 - rate) * dy_norm > tol
+        )
+        pred = jnp.logical_and(pred, dy_norm_old >= 0)
+        k = jnp.where(pred, NEWTON_MAXITER - 1, k)
 
         d += dy
-        y = y0 + d
 
         # if converged then break out of iteration early
-        pred = dy_norm_old >= 0.
-        pred *= rate / (1 - rate) * dy_norm < tol
-        converged = (dy_norm == 0.) + pred
+        pred = jnp.logical_and(dy_norm_old >= 0., rate / (1 - rate) * dy_norm < tol)
+        converged = jnp.logical_or(dy_norm == 0., pred)
 
         dy_norm_old = dy_norm
 
-        return [k + 1, converged, dy_norm_old, d, y, n_function_evals]
+        return [k + 1, converged, dy_norm_old, d, n_function_evals]
 
-    k, converged, dy_norm_old, d, y, n_function_evals = \
+    k, converged, dy_norm_old, d, n_function_evals = \
         jax.lax.while_loop(while_cond,
                            while_body,
                            while_state)
+    y = y0 + d
     return converged, k, y, d, state._replace(n_function_evals=n_function_evals)
 
 
@@ -520,34 +645,31 @@ def rms_norm(arg):
 
 def _prepare_next_step(state, d):
     D = _update_difference_for_next_step(state, d)
-    psi = _update_psi(state, D)
-    y0, scale_y0 = _predict(state, D)
+    y0, scale_y0, psi = _predict_and_update_psi(state, D)
     return state._replace(D=D, psi=psi, y0=y0, scale_y0=scale_y0)
 
 
-def _prepare_next_step_order_change(state, d, y, n_iter):
+def _prepare_next_step_order_change(state, d, scale_y, error_norm, safety):
+    """
+    scale_y, error_norm and safety are those calculated for the accepted step in
+    _bdf_step
+    """
     order = state.order
+    error_const = jnp.asarray(ERROR_CONST)
 
     D = _update_difference_for_next_step(state, d)
 
-    # Note: we are recalculating these from the while loop above, could re-use?
-    scale_y = state.atol + state.rtol * jnp.abs(y)
-    error = state.error_const[order] * d
-    error_norm = rms_norm(error / scale_y)
-    safety = 0.9 * (2 * NEWTON_MAXITER + 1) / (2 * NEWTON_MAXITER
-                                               + n_iter)
-
     # similar to the optimal step size factor we calculated above for the current
     # order k, we need to calculate the optimal step size factors for orders
     # k-1 and k+1. To do this, we note that the error = C_k * D^{k+1} y_n
     error_m_norm = jnp.where(
         order > 1,
-        rms_norm(state.error_const[order - 1] * D[order] / scale_y),
+        rms_norm(error_const[order - 1] * D[order] / scale_y),
         jnp.inf
     )
     error_p_norm = jnp.where(
         order < MAX_ORDER,
-        rms_norm(state.error_const[order + 1] * D[order + 2] / scale_y),
+        rms_norm(error_const[order + 1] * D[order + 2] / scale_y),
         jnp.inf
     )
 
@@ -573,29 +695,36 @@ def _bdf_step(state, fun, jac):
     # initialise step size and try to make the step,
     # iterate, reducing step size until error is in bounds
     step_accepted = False
-    y = jnp.empty_like(state.y0)
     d = jnp.empty_like(state.y0)
-    n_iter = -1
+    scale_y = jnp.empty_like(state.y0)
+    error_norm = 0.0
+    safety = 0.0
 
     # loop until step is accepted
-    while_state = [state, step_accepted, updated_jacobian, y, d, n_iter]
+    while_state = [state, step_accepted, updated_jacobian, d, scale_y, error_norm,
+                   safety]
 
     def while_cond(while_state):
-        _, step_accepted, _, _, _, _ = while_state
+        _, step_accepted, _, _, _, _, _ = while_state
         return step_accepted == False  # noqa: E712
 
     def while_body(while_state):
-        state, step_accepted, updated_jacobian, y, d, n_iter = while_state
+        state, step_accepted, updated_jacobian, d, scale_y, error_norm, safety = \
+            while_state
 
         # solve BDF equation using y0 as starting point
         converged, n_iter, y, d, state = _newton_iteration(state, fun)
         not_converged = converged == False  # noqa: E712
 
+        # the jacobian and lu updates below are expensive, so are done using
+        # jax.lax.cond so that they are only evaluated if they are needed
+
         # newton iteration did not converge, but jacobian has already been
         # evaluated so reduce step size by 0.3 (as per [1]) and try again
-        state = tree_multimap(
-            partial(jnp.where, not_converged * updated_jacobian),
-            _update_step_size_and_lu(state, 0.3),
+        state = jax.lax.cond(
+            jnp.logical_and(not_converged, updated_jacobian),
+            lambda state: _update_step_size_and_lu(state, 0.3),
+            lambda state: state,
             state
         )
 
@@ -606,14 +735,16 @@ def _bdf_step(state, fun, jac):
 
         # if not converged and jacobian not updated, then update the jacobian and try
         # again
-        (state, updated_jacobian) = tree_multimap(
-            partial(
-                jnp.where,
-                not_converged * (updated_jacobian == False)  # noqa: E712
-            ),
-            (_update_jacobian(state, jac), True),
-            (state, False + updated_jacobian)
+        update_jacobian = jnp.logical_and(
+            not_converged, jnp.logical_not(updated_jacobian)
+        )
+        state = jax.lax.cond(
+            update_jacobian,
+            lambda state: _update_jacobian(state, jac),
+            lambda state: state,
+            state
         )
+        updated_jacobian = jnp.logical_or(updated_jacobian, update_jacobian)
 
         safety = 0.9 * (2 * NEWTON_MAXITER + 1) / (2 * NEWTON_MAXITER + n_iter)
         scale_y = state.atol + state.rtol * jnp.abs(y)
@@ -621,7 +752,7 @@ def _bdf_step(state, fun, jac):
         # combine eq 3, 4 and 6 from [1] to obtain error
         # Note that error = C_k * h^{k+1} y^{k+1}
         # and d = D^{k+1} y_{n+1} \approx h^{k+1} y^{k+1}
-        error = state.error_const[state.order] * d
+        error = jnp.asarray(ERROR_CONST)[state.order] * d
 
         error_norm = rms_norm(error / scale_y)
 
@@ -633,18 +764,19 @@ def _bdf_step(state, fun, jac):
         #if converged * (error_norm > 1):
         #    print('converged, but error is too large',error_norm, factor, d, scale_y)
 
-        (state, step_accepted) = tree_multimap(
-            partial(
-                jnp.where,
-                converged * (error_norm > 1)  # noqa: E712
-            ),
-            (_update_step_size_and_lu(state, factor), False),
-            (state, converged)
+        error_too_large = jnp.logical_and(converged, error_norm > 1)
+        state = jax.lax.cond(
+            error_too_large,
+            lambda operand: _update_step_size_and_lu(*operand),
+            lambda operand: operand[0],
+            (state, factor)
         )
+        step_accepted = jnp.logical_and(converged, jnp.logical_not(error_too_large))
 
-        return [state, step_accepted, updated_jacobian, y, d, n_iter]
+        return [state, step_accepted, updated_jacobian, d, scale_y, error_norm,
+                safety]
 
-    state, step_accepted, updated_jacobian, y, d, n_iter = \
+    state, step_accepted, updated_jacobian, d, scale_y, error_norm, safety = \
         jax.lax.while_loop(while_cond, while_body, while_state)
 
     # take the accepted step
@@ -657,10 +789,13 @@ def _bdf_step(state, fun, jac):
 
     state = state._replace(n_equal_steps=n_equal_steps, t=t, n_steps=n_steps)
 
-    state = tree_multimap(
-        partial(jnp.where, n_equal_steps < state.order + 1),
-        _prepare_next_step(state, d),
-        _prepare_next_step_order_change(state, d, y, n_iter)
+    # only consider a change of order (which needs a new lu factorisation) once
+    # enough equal steps have been taken
+    state = jax.lax.cond(
+        n_equal_steps < state.order + 1,
+        lambda operand: _prepare_next_step(*operand[:2]),
+        lambda operand: _prepare_next_step_order_change(*operand),
+        (state, d, scale_y, error_norm, safety)
     )
 
     return state
@@ -671,31 +806,23 @@ def _bdf_interpolate(state, t_eval):
     interpolate solution at time values t* where t-h < t* < t
 
     definition of the interpolating polynomial can be found on page 7 of [1]
+
+    t_eval can be a scalar, or an array of shape (m,) in which case the solution at
+    all m time points is returned with shape (m, n)
     """
     order = state.order
     t = state.t
     h = state.h
     D = state.D
-    j = 0
-    time_factor = 1.0
-    order_summation = D[0]
-    while_state = [j, time_factor, order_summation]
-
-    def while_cond(while_state):
-        j, _, _ = while_state
-        return j < order
-
-    def while_body(while_state):
-        j, time_factor, order_summation = while_state
-        time_factor *= (t_eval - (t - h * j)) / (h * (1 + j))
-        order_summation += D[j + 1] * time_factor
-        j += 1
-        return [j, time_factor, order_summation]
 
-    j, time_factor, order_summation = jax.lax.while_loop(while_cond,
-                                                         while_body,
-                                                         while_state)
-    return order_summation
+    # the time factors for all MAX_ORDER differences are evaluated at once, and those
+    # above the current order masked out
+    j = ORDER_INDICES[:-1]
+    time_factor = jnp.cumprod(
+        (jnp.expand_dims(t_eval, -1) - (t - h * j)) / (h * (1 + j)), axis=-1
+    )
+    time_factor = jnp.where(j < order, time_factor, 0)
+    return D[0] + jnp.dot(time_factor, D[1:])
 
 
 def block_diag(lst):
@@ -737,7 +864,8 @@ def block_diag(lst):
 # governing permissions and limitations under the License.
 
 
-def jax_bdf_integrate(func, y0, t_eval, *args, rtol=1e-6, atol=1e-6, mass=None):
+def jax_bdf_integrate(func, y0, t_eval, *args, rtol=1e-6, atol=1e-6, mass=None,
+                      jac_sparsity=None):
     """
     Backward Difference formula (BDF) implicit multistep integrator. The basic algorithm
     is derived in [2]_. This particular implementation follows that implemented in the
@@ -767,6 +895,11 @@ def jax_bdf_integrate(func, y0, t_eval, *args, rtol=1e-6, atol=1e-6, mass=None):
         absolute tolerance for the solver
     mass: (optional) ndarray
         diagonal of the mass matrix with shape (n,)
+    jac_sparsity: (optional) ndarray
+        boolean sparsity pattern of the jacobian of `func` with respect to the
+        (flattened) state vector, with shape (n, n). If given, the jacobian is
+        calculated using one jvp per group of structurally independent columns, rather
+        than one per column, which is much cheaper for banded jacobians
 
     Returns
     -------
@@ -794,7 +927,55 @@ def jax_bdf_integrate(func, y0, t_eval, *args, rtol=1e-6, atol=1e-6, mass=None):
     flat_args, in_tree = tree_flatten((y0, t_eval[0], *args))
     in_avals = tuple(safe_map(abstractify, flat_args))
     converted, consts = closure_convert(func, in_tree, in_avals)
-    return _bdf_odeint_wrapper(converted, mass, rtol, atol, y0, t_eval, *consts, *args)
+    if jac_sparsity is not None:
+        jac_sparsity = _sparsity_key(jac_sparsity)
+    return _bdf_odeint_wrapper(converted, mass, jac_sparsity, rtol, atol, y0, t_eval,
+                               *consts, *args)
+
+
+def jax_bdf_integrate_batched(func, y0, t_eval, *args, rtol=1e-6, atol=1e-6,
+                              mass=None, jac_sparsity=None):
+    """
+    Solves the same system as :func:`jax_bdf_integrate` for a batch of initial
+    conditions, by vectorising the solver over the leading axis of `y0` with
+    `jax.vmap`. All the solves share `func`, `t_eval`, `args`, the tolerances and the
+    mass matrix, so on an accelerator they are run in parallel rather than one after
+    the other.
+
+    Parameters
+    ----------
+
+    func: callable
+        function to evaluate the time derivative of the solution `y` at time
+        `t` as `func(y, t, *args)`, producing the same shape/structure as `y0[i]`.
+    y0: ndarray
+        batch of initial state vectors, with the batch along the leading axis
+    t_eval: ndarray
+        time points to evaluate the solution, has shape (m,)
+    args: (optional)
+        tuple of additional arguments for `fun`, which must be arrays
+        scalars, or (nested) standard Python containers (tuples, lists, dicts,
+        namedtuples, i.e. pytrees) of those types.
+    rtol: (optional) float
+        relative tolerance for the solver
+    atol: (optional) float
+        absolute tolerance for the solver
+    mass: (optional) ndarray
+        mass matrix with shape (n, n)
+    jac_sparsity: (optional) ndarray
+        boolean sparsity pattern of the jacobian, see :func:`jax_bdf_integrate`
+
+    Returns
+    -------
+    y: ndarray with shape (b, m, n)
+        calculated state vector at each of the m time points, for each of the b initial
+        conditions
+    """
+    def integrate(y0):
+        return jax_bdf_integrate(func, y0, t_eval, *args, rtol=rtol, atol=atol,
+                                 mass=mass, jac_sparsity=jac_sparsity)
+
+    return jax.vmap(integrate)(y0)
 
 
 def flax_while_loop(cond_fun, body_fun, init_val):  # pragma: no cover
@@ -831,25 +1012,27 @@ def flax_scan(f, init, xs, length=None):  # pragma: no cover
     return carry, onp.stack(ys)
 
 
-@jax.partial(jax.jit, static_argnums=(0, 1, 2, 3))
-def _bdf_odeint_wrapper(func, mass, rtol, atol, y0, ts, *args):
+# note: rtol and atol are traced rather than static arguments, so changing the
+# tolerances does not trigger a recompilation of the solver
+@jax.partial(jax.jit, static_argnums=(0, 1, 2))
+def _bdf_odeint_wrapper(func, mass, jac_sparsity, rtol, atol, y0, ts, *args):
     y0, unravel = ravel_pytree(y0)
     if mass is None:
-        mass = onp.identity(y0.shape[0], dtype=y0.dtype)
+        mass = _identity(y0.shape[0], y0.dtype)
     else:
         mass = block_diag(tree_flatten(mass)[0])
     func = ravel_first_arg(func, unravel)
-    out = _bdf_odeint(func, mass, rtol, atol, y0, ts, *args)
+    out = _bdf_odeint(func, mass, jac_sparsity, rtol, atol, y0, ts, *args)
     return jax.vmap(unravel)(out)
 
 
-def _bdf_odeint_fwd(func, mass, rtol, atol, y0, ts, *args):
-    ys = _bdf_odeint(func, mass, rtol, atol, y0, ts, *args)
-    return ys, (ys, ts, args)
+def _bdf_odeint_fwd(func, mass, jac_sparsity, rtol, atol, y0, ts, *args):
+    ys = _bdf_odeint(func, mass, jac_sparsity, rtol, atol, y0, ts, *args)
+    return ys, (ys, ts, rtol, atol, args)
 
 
-def _bdf_odeint_rev(func, mass, rtol, atol, res, g):
-    ys, ts, args = res
+def _bdf_odeint_rev(func, mass, jac_sparsity, res, g):
+    ys, ts, rtol, atol, args = res
 
     def aug_dynamics(augmented_state, t, *args):
         """Original system augmented with vjp_y, vjp_t and vjp_args."""
@@ -893,10 +1076,8 @@ def _bdf_odeint_rev(func, mass, rtol, atol, res, g):
             LU = jax.scipy.linalg.lu_factor(J_aa)
             g0_a = g0[algebraic_variables]
             invJ_aa = jax.scipy.linalg.lu_solve(LU, g0_a)
-            y_bar = jax.ops.index_update(
-                g0, differentiable_variables,
-                jax.scipy.linalg.lu_solve(LU_invM_dd,
-                                          g0_a - J_ad @ invJ_aa)
+            y_bar = g0.at[differentiable_variables].set(
+                jax.scipy.linalg.lu_solve(LU_invM_dd, g0_a - J_ad @ invJ_aa)
             )
         else:
             y_bar = jax.scipy.linalg.lu_solve(LU_invM_dd, g0)
@@ -907,7 +1088,7 @@ def _bdf_odeint_rev(func, mass, rtol, atol, res, g):
     t0_bar = 0.
 
     def arg_to_identity(arg):
-        return onp.identity(arg.shape[0] if arg.ndim > 0 else 1, dtype=arg.dtype)
+        return _identity(arg.shape[0] if arg.ndim > 0 else 1, arg.dtype)
 
     aug_mass = (mass, mass, jnp.array(1.), tree_map(arg_to_identity, args))
 
@@ -931,7 +1112,8 @@ def _bdf_odeint_rev(func, mass, rtol, atol, res, g):
     (y_bar, t0_bar, args_bar), rev_ts_bar = jax.lax.scan(
         scan_fun, init_carry, jnp.arange(len(ts) - 1, 0, -1))
     ts_bar = jnp.concatenate([jnp.array([t0_bar]), rev_ts_bar[::-1]])
-    return (y_bar, ts_bar, *args_bar)
+    # the solution is not differentiated with respect to the tolerances
+    return (jnp.zeros_like(rtol), jnp.zeros_like(atol), y_bar, ts_bar, *args_bar)
 
 
 _bdf_odeint.defvjp(_bdf_odeint_fwd, _bdf_odeint_rev)
@@ -83,9 +83,7 @@ class JaxSolver(pybamm.BaseSolver):
                 raise RuntimeError("Model is not set up for solving, run"
                                    "`solver.solve(model)` first")
 
-            self._cached_solves[model] = self.create_solve(model, t_eval)
-
-        return self._cached_solves[model]
+        return self.create_solve(model, t_eval)
 
     def create_solve(self, model, t_eval):
         """
@@ -104,6 +102,27 @@ class JaxSolver(pybamm.BaseSolver):
             A function with signature `f(inputs)`, where inputs are a dict containing
             any input parameters to pass to the model when solving
 
+        """
+        solve = self._get_compiled_solve(model)
+        return lambda inputs: solve(t_eval, inputs)
+
+    def _get_compiled_solve(self, model):
+        """
+        Return the compiled JAX function that solves the model, with signature
+        `f(t_eval, inputs)`, creating it if this is the first time it is needed.
+
+        The times at which to compute the solution are an argument of the compiled
+        function, so it is only compiled once for each length of `t_eval`, and can
+        be reused for different output times without recompiling.
+        """
+        if model not in self._cached_solves:
+            self._cached_solves[model] = self._create_compiled_solve(model)
+        return self._cached_solves[model]
+
+    def _create_compiled_solve(self, model):
+        """
+        Return a compiled JAX function with signature `f(t_eval, inputs)` that solves
+        an ode model, see :meth:`create_solve`.
         """
         if model.convert_to_format != "jax":
             raise RuntimeError("Model must be converted to JAX to use this solver"
@@ -133,7 +152,7 @@ class JaxSolver(pybamm.BaseSolver):
                 model.algebraic_eval(t, y, inputs),
             ])
 
-        def solve_model_rk45(inputs):
+        def solve_model_rk45(t_eval, inputs):
             y = odeint(
                 rhs_ode,
                 y0,
@@ -145,7 +164,7 @@ class JaxSolver(pybamm.BaseSolver):
             )
             return jnp.transpose(y)
 
-        def solve_model_bdf(inputs):
+        def solve_model_bdf(t_eval, inputs):
             y = pybamm.jax_bdf_integrate(
                 rhs_dae,
                 y0,
@@ -183,10 +202,7 @@ class JaxSolver(pybamm.BaseSolver):
             various diagnostic messages.
 
         """
-        if model not in self._cached_solves:
-            self._cached_solves[model] = self.create_solve(model, t_eval)
-
-        y = self._cached_solves[model](inputs)
+        y = self._get_compiled_solve(model)(t_eval, inputs)
 
         # note - the actual solve is not done until this line!
         y = onp.array(y)
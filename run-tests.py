@@ -7,11 +7,41 @@
 #
 import re
 import os
-import pybamm
 import sys
-import argparse
-import unittest
-import subprocess
+
+# Lines removed from the code converted from notebooks: the coding statement, and the
+# "%pip install pybamm -q" command, which is only needed to install PyBaMM on Google
+# Colab
+_CODING_RE = re.compile(r"^# coding[^\n]*\n?", re.M)
+_PIP_INSTALL_RE = re.compile(
+    r"^get_ipython\(\)\.run_line_magic\('pip', 'install pybamm[^\n]*\n?", re.M
+)
+
+# "In [1]:" comments in the code exported from notebooks
+_IN_CELL_RE = re.compile(r"(\s*)# In\[([^]]*)\]:(\s)*")
+
+# Code cells in the JSON of a notebook
+_CODE_CELL_RE = re.compile(rb'"cell_type"\s*:\s*"code"')
+
+# Time, in seconds, after which a notebook or script is stopped and reported as
+# failed
+EXAMPLE_TIMEOUT = 3600
+
+
+def resolve_command(command):
+    """
+    Returns the command with its executable resolved to a full path, if it is found
+    on the path.
+
+    Subprocesses are started with close_fds=False: file descriptors are not
+    inheritable by default (PEP 446), so there is nothing extra to close, and this
+    avoids closing every possible descriptor in each child. Together with the full
+    path to the executable, this allows CPython (3.8+, on Linux) to start the child
+    with posix_spawn rather than fork and exec.
+    """
+    import shutil
+
+    return [shutil.which(command[0]) or command[0]] + list(command[1:])
 
 
 def run_code_tests(executable=False, folder: str = "unit"):
@@ -21,7 +51,8 @@ def run_code_tests(executable=False, folder: str = "unit"):
     ----------
     executable : bool (default False)
         If True, tests are run in subprocesses using the executable 'python'.
-        Must be True for travis tests (otherwise tests always 'pass')
+        Must be True for travis tests (otherwise tests always 'pass'). If
+        pytest-xdist is installed, the tests are split across several processes.
     folder : str
         Which folder to run the tests from (unit, integration or both ('all'))
     """
@@ -30,14 +61,21 @@ def run_code_tests(executable=False, folder: str = "unit"):
     else:
         tests = "tests/" + folder
         if folder == "unit":
+            import pybamm
+
             pybamm.settings.debug_mode = True
     if executable is False:
+        import unittest
+
         suite = unittest.defaultTestLoader.discover(tests, pattern="test*.py")
         unittest.TextTestRunner(verbosity=2).run(suite)
     else:
+        import subprocess
+
         print("Running {} tests with executable 'python'".format(folder))
-        cmd = ["python", "-m", "unittest", "discover", "-v", tests]
-        p = subprocess.Popen(cmd)
+        p = subprocess.Popen(
+            resolve_command(code_tests_command(tests)), close_fds=False
+        )
         try:
             ret = p.wait()
         except KeyboardInterrupt:
@@ -52,13 +90,97 @@ def run_code_tests(executable=False, folder: str = "unit"):
             sys.exit(ret)
 
 
+def code_tests_command(tests):
+    """
+    Returns the command used to run the tests in a subprocess. If pytest-xdist is
+    available the tests are distributed over all but two of the cores, keeping the
+    tests from each file on the same worker; otherwise they are run serially using
+    unittest.
+
+    The check for pytest-xdist is done by the same 'python' that runs the tests, as
+    this can be a different environment to the one running this script.
+    """
+    import subprocess
+
+    has_xdist = subprocess.call(
+        resolve_command(
+            [
+                "python",
+                "-c",
+                "import importlib.util, sys; "
+                "sys.exit(importlib.util.find_spec('xdist') is None)",
+            ]
+        ),
+        close_fds=False,
+    )
+    if has_xdist != 0:
+        return ["python", "-m", "unittest", "discover", "-v", tests]
+
+    return [
+        "python",
+        "-m",
+        "pytest",
+        "-n",
+        str(default_workers()),
+        "--dist=loadfile",
+        "-q",
+        tests,
+    ]
+
+
 def run_flake8():
     """
     Runs flake8 in a subprocess, exits if it doesn't finish.
     """
-    print("Running flake8 ... ")
+    run_style_check("flake8", ["flake8"])
+
+
+# The closest ruff equivalent of the settings in .flake8. Ruff has no W503, W504 or
+# F812 rules, and E713 and E714 are ignored as pycodestyle does not report them for
+# parenthesised expressions. Ruff is stricter about long lines inside multi-line
+# strings, which pycodestyle does not check, hence the one per-file ignore.
+# Note that this does NOT cover everything flake8 checks: the pycodestyle
+# indentation (E1, apart from E101), whitespace (E2) and blank line (E3) rules, and
+# W391, are only available in ruff's preview mode. So use flake8 for the full check
+RUFF_COMMAND = [
+    "ruff",
+    "check",
+    ".",
+    "--quiet",
+    "--line-length=88",
+    "--select=E,F,W",
+    "--ignore=E203,E265,E713,E714,E741,W391,W605",
+    "--extend-exclude=problems,__init__.py,venv,bin,etc,lib,lib64,share,pyvenv.cfg,"
+    "third-party,KLU_module_deps,*.ipynb",
+    "--per-file-ignores=pybamm/meshes/one_dimensional_submeshes.py:E501",
+]
+
+
+def run_lint():
+    """
+    Runs a quick style check with ruff in a subprocess, exits if there are any
+    issues. This is much faster than flake8 but does not check everything flake8
+    does (see RUFF_COMMAND). Runs flake8 instead if ruff is not installed.
+    """
+    import shutil
+
+    if shutil.which("ruff"):
+        run_style_check("ruff", RUFF_COMMAND)
+    else:
+        run_flake8()
+
+
+def run_style_check(name, command):
+    """
+    Runs a style checker in a subprocess, exits if it finds any issues.
+    """
+    import subprocess
+
+    print("Running " + name + " ... ")
     sys.stdout.flush()
-    p = subprocess.Popen(["flake8"], stderr=subprocess.PIPE)
+    p = subprocess.Popen(
+        resolve_command(command), stderr=subprocess.PIPE, close_fds=False
+    )
     try:
         ret = p.wait()
     except KeyboardInterrupt:
@@ -81,9 +203,14 @@ def run_doc_tests():
     Checks if the documentation can be built, runs any doctests (currently not
     used).
     """
+    import subprocess
+
     print("Checking if docs can be built.")
     p = subprocess.Popen(
-        ["sphinx-build", "-b", "doctest", "docs", "docs/build/html", "-W"]
+        resolve_command(
+            ["sphinx-build", "-b", "doctest", "docs", "docs/build/html", "-W"]
+        ),
+        close_fds=False,
     )
     try:
         ret = p.wait()
@@ -100,87 +227,517 @@ def run_doc_tests():
         sys.exit(ret)
 
 
-def run_notebook_and_scripts(skip_slow_books=False, executable="python"):
+def run_notebook_and_scripts(skip_slow_books=False, executable="python", shard=None):
     """
     Runs Jupyter notebook tests. Exits if they fail.
+
+    If `shard` is given as a tuple `(i, n)`, only the i-th of n equal parts of the
+    notebooks and scripts is run, so that the tests can be split over several jobs.
     """
     # Ignore slow books?
-    ignore_list = []
+    ignore_list = frozenset()
     if skip_slow_books and os.path.isfile(".slow-books"):
-        with open(".slow-books", "r") as f:
-            for line in f.readlines():
-                line = line.strip()
-                if not line or line[:1] == "#":
-                    continue
-                if not line.startswith("examples/"):
-                    line = "examples/" + line
-                if not line.endswith(".ipynb"):
-                    line = line + ".ipynb"
-                if not os.path.isfile(line):
-                    raise Exception("Slow notebook note found: " + line)
-                ignore_list.append(line)
+        ignore_list = load_slow_books(".slow-books")
 
     # Scan and run
     print("Testing notebooks and scripts with executable `" + str(executable) + "`")
-    if not scan_for_nb_and_scripts("examples", True, executable, ignore_list):
+    if not scan_for_nb_and_scripts("examples", True, executable, ignore_list, shard):
         print("\nErrors encountered in notebooks")
         sys.exit(1)
     print("\nOK")
 
 
-def scan_for_nb_and_scripts(root, recursive=True, executable="python", ignore_list=[]):
+def load_slow_books(path):
+    """
+    Returns the set of slow notebooks listed in the file at path, as normalised
+    paths so they can be compared with the scanned paths in constant time.
+    """
+    ignore_list = []
+    with open(path, "r") as f:
+        for line in f.readlines():
+            line = line.strip()
+            if not line or line[:1] == "#":
+                continue
+            if not line.startswith("examples/"):
+                line = "examples/" + line
+            if not line.endswith(".ipynb"):
+                line = line + ".ipynb"
+            if not os.path.isfile(line):
+                raise Exception("Slow notebook note found: " + line)
+            ignore_list.append(os.path.normpath(line))
+    return frozenset(ignore_list)
+
+
+def scan_for_nb_and_scripts(
+    root, recursive=True, executable="python", ignore_list=[], shard=None
+):
     """
     Scans for, and tests, all notebooks and scripts in a directory.
     """
+    import asyncio
+
+    notebooks, scripts = find_nb_and_scripts(root, recursive, ignore_list)
+    if shard is not None:
+        notebooks, scripts = select_shard(notebooks, scripts, *shard)
+
+    loop = asyncio.get_event_loop()
+    try:
+        return loop.run_until_complete(
+            test_nb_and_scripts(notebooks, scripts, executable)
+        )
+    except KeyboardInterrupt:
+        print("ABORTED")
+        stop_pool()
+        sys.exit(1)
+
+
+def select_shard(notebooks, scripts, i, n):
+    """
+    Returns the notebooks and scripts in the i-th of n shards. The paths are
+    sorted first, so that every job computes the same split.
+    """
+    selected = frozenset(sorted(notebooks + scripts)[i::n])
+    return (
+        [path for path in notebooks if path in selected],
+        [path for path in scripts if path in selected],
+    )
+
+
+def shard_spec(value):
+    """
+    Parses a shard given as "i/n" on the command line, with 0 <= i < n.
+    """
+    import argparse
+
+    try:
+        i, n = (int(x) for x in value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError("shard must be given as i/n")
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError("shard must satisfy 0 <= i < n")
+    return i, n
+
+
+async def test_nb_and_scripts(notebooks, scripts, executable="python"):
+    """
+    Tests notebooks and scripts concurrently, and prints the results in order.
+    Returns True if they all ran successfully.
+    """
+    import asyncio
+
+    # Limit the number of subprocesses running at once, for notebooks and scripts
+    # that are run with a different executable
+    semaphore = asyncio.Semaphore(default_workers())
+
+    # Start all the tests before waiting for any of them
+    tests = [
+        asyncio.ensure_future(test_notebook(path, semaphore, executable))
+        for path in notebooks
+    ] + [
+        asyncio.ensure_future(test_script(path, semaphore, executable))
+        for path in scripts
+    ]
+
     ok = True
-    debug = False
-
-    # Scan path
-    for filename in os.listdir(root):
-        path = os.path.join(root, filename)
-        if path in ignore_list:
-            print("Skipping slow book: " + path)
-            continue
-
-        # Recurse into subdirectories
-        if recursive and os.path.isdir(path):
-            # Ignore hidden directories
-            if filename[:1] == ".":
-                continue
-            ok &= scan_for_nb_and_scripts(path, recursive, executable)
-
-        # Test notebooks
-        if os.path.splitext(path)[1] == ".ipynb":
-            if debug:
-                print(path)
-            else:
-                ok &= test_notebook(path, executable)
-        # Test scripts
-        elif os.path.splitext(path)[1] == ".py":
-            if debug:
-                print(path)
-            else:
-                ok &= test_script(path, executable)
+    for test in tests:
+        report = await test
+        ok &= report()
 
     # Return True if every notebook is ok
     return ok
 
 
-def test_notebook(path, executable="python"):
+def find_nb_and_scripts(root, recursive=True, ignore_list=[]):
+    """
+    Returns lists of the paths of all the notebooks and scripts in a directory.
+    """
+    notebooks = []
+    scripts = []
+    if not isinstance(ignore_list, (set, frozenset)):
+        ignore_list = frozenset(ignore_list)
+
+    # Scan path. The entries returned by scandir cache their type, so this needs
+    # fewer stat calls than listdir followed by isdir on each path
+    with os.scandir(root) as entries:
+        for entry in entries:
+            path = entry.path
+            name = entry.name
+            if os.path.normpath(path) in ignore_list:
+                print("Skipping slow book: " + path)
+                continue
+
+            # Recurse into subdirectories
+            if recursive and entry.is_dir():
+                # Ignore hidden directories
+                if name[:1] == ".":
+                    continue
+                sub_notebooks, sub_scripts = find_nb_and_scripts(
+                    path, recursive, ignore_list
+                )
+                notebooks += sub_notebooks
+                scripts += sub_scripts
+
+            # Leading dots do not start an extension, as in os.path.splitext
+            dot = name.rfind(".")
+            ext = name[dot + 1 :] if dot > 0 else ""
+            if ext == "ipynb":
+                notebooks.append(path)
+            elif ext == "py":
+                scripts.append(path)
+
+    return notebooks, scripts
+
+
+_POOL = None
+
+# Futures of the calls submitted to the pool, so that they can be cancelled
+_FUTURES = []
+
+
+def get_pool():
+    """
+    Returns the pool of worker processes used to run the notebooks, creating it the
+    first time it is needed.
+    """
+    global _POOL
+    if _POOL is None:
+        from concurrent.futures import ProcessPoolExecutor
+
+        _POOL = ProcessPoolExecutor(max_workers=default_workers())
+    return _POOL
+
+
+def submit(fn, *args):
+    """
+    Submits a call to the pool of worker processes, returns an asyncio future for
+    its result.
+    """
+    import asyncio
+
+    future = get_pool().submit(fn, *args)
+    _FUTURES.append(future)
+    return asyncio.wrap_future(future)
+
+
+def stop_pool():
+    """
+    Stops the pool of worker processes straight away, by cancelling the calls that
+    have not started and terminating the workers. Shutting the pool down normally
+    would wait for every call that was submitted to it.
+    """
+    if _POOL is None:
+        return
+    for future in _FUTURES:
+        future.cancel()
+    # shutdown(cancel_futures=True) needs python 3.9, so the workers are terminated
+    # by hand
+    for process in list(_POOL._processes.values()):
+        process.terminate()
+    _POOL.shutdown()
+
+
+def runs_in_pool(executable):
+    """
+    Returns True if examples to be run with the executable can be run in the pool of
+    worker processes, which run them with this python (`sys.executable`). This is
+    only the case if the executable is found on the path in the same directory as
+    this python, so that a different python, or virtual environment, is never
+    swapped for this one.
     """
-    Tests a single notebook, exists if it doesn't finish.
+    import shutil
+
+    path = shutil.which(executable)
+    return (
+        path is not None
+        and os.path.dirname(os.path.abspath(path))
+        == os.path.dirname(os.path.abspath(sys.executable))
+        and os.path.samefile(path, sys.executable)
+    )
+
+
+def default_workers():
+    """
+    Returns the number of notebooks, scripts or test processes to run at once, which
+    leaves two cores free.
+    """
+    return max(1, (os.cpu_count() or 1) - 2)
+
+
+def exec_example(path, notebook=False):
+    """
+    Runs an example script, or notebook, in a worker process. Returns the exit code,
+    what was written to stdout and stderr, the time taken, and for notebooks the
+    python code that the notebook was converted to.
+
+    Notebooks are converted in the worker too, so that converting one notebook
+    overlaps with running the others. This is done in the worker processes rather
+    than in a thread of the main process, as forking the workers while another
+    thread is importing modules can leave them deadlocked.
+    """
+    import traceback
+
+    # Tell matplotlib not to produce any figures
+    os.environ["MPLBACKEND"] = "Template"
+    from pybamm import Timer
+
+    b = Timer()
+    code = None
+    try:
+        if notebook:
+            code = notebook_code(path)
+            source = code
+        else:
+            with open(path, "rb") as f:
+                source = f.read()
+        code_obj = compile(source, path, "exec")
+    except Exception:
+        return 1, "", traceback.format_exc(), b.time(), code
+
+    # If notebook makes use of magic commands then
+    # the script must be ran using ipython, in a subprocess
+    # https://github.com/jupyter/nbconvert/issues/503#issuecomment-269527834
+    if notebook and uses_magic(code):
+        result = exec_code_with_ipython(code)
+    else:
+        result = exec_code(code_obj, path, not notebook)
+    return result + (b.time(), code)
+
+
+def uses_magic(code):
+    """
+    Returns True if the code converted from a notebook uses magic commands.
+    """
+    return ("run_cell_magic(" in code) or ("run_line_magic(" in code)
+
+
+def exec_code(code_obj, path, is_script):
+    """
+    Runs code in the worker process, returns the exit code and what was written to
+    stdout and stderr.
+
+    Each worker only imports pybamm (and numpy, scipy, casadi, ...) once. Where
+    possible, the code is then run in a child process forked from the worker, so
+    that it starts with these already imported but cannot change the state of the
+    worker, or of the examples run after it.
+    """
+    import multiprocessing
+    import tempfile
+
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return exec_code_in_process(code_obj, path, is_script)
+
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        p = multiprocessing.get_context("fork").Process(
+            target=exec_code_in_child,
+            args=(code_obj, path, is_script, stdout.fileno(), stderr.fileno()),
+        )
+        p.start()
+        p.join(timeout=EXAMPLE_TIMEOUT)
+        if p.is_alive():
+            p.terminate()
+            p.join()
+            write_timed_out(stderr)
+        return (p.exitcode,) + read_output(p.exitcode, stdout, stderr)
+
+
+def exec_code_with_ipython(code):
     """
+    Runs code using ipython in a subprocess, returns the exit code and what was
+    written to stdout and stderr.
+    """
+    import subprocess
+    import tempfile
+
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        p = subprocess.Popen(
+            resolve_command(["ipython", "-c", code]),
+            stdout=stdout,
+            stderr=stderr,
+            close_fds=False,
+        )
+        try:
+            p.wait(timeout=EXAMPLE_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            p.kill()
+            p.wait()
+            write_timed_out(stderr)
+        return (p.returncode,) + read_output(p.returncode, stdout, stderr)
+
+
+def write_timed_out(stderr):
+    """
+    Adds a message to the stderr file of an example that was stopped after
+    EXAMPLE_TIMEOUT seconds.
+    """
+    stderr.write("\nTimed out after {} seconds\n".format(EXAMPLE_TIMEOUT).encode())
+
+
+def read_output(returncode, stdout, stderr):
+    """
+    Returns what was written to the stdout and stderr files. The output is only
+    reported if the test failed, so on success it is not read back at all.
+    """
+    if returncode == 0:
+        return "", ""
+    stdout.seek(0)
+    stderr.seek(0)
+    return (
+        str(stdout.read(), "utf-8", "replace"),
+        str(stderr.read(), "utf-8", "replace"),
+    )
+
+
+def main_globals(path, is_script):
+    """
+    Returns the globals to run an example in. Scripts are set up as they would be by
+    `python path`: with `__file__` and `sys.argv` set, and the directory of the
+    script at the start of `sys.path`.
+    """
+    if not is_script:
+        return {"__name__": "__main__"}
+    sys.argv = [path]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    return {"__name__": "__main__", "__file__": path}
+
+
+def exec_code_in_child(code_obj, path, is_script, stdout_fd, stderr_fd):
+    """
+    Target of the child process forked to run an example: redirects stdout and
+    stderr to the given files and runs the code. Uncaught exceptions are printed to
+    stderr and give a nonzero exit code.
+    """
+    os.dup2(stdout_fd, 1)
+    os.dup2(stderr_fd, 2)
+    exec(code_obj, main_globals(path, is_script))
+
+
+def exec_code_in_process(code_obj, path, is_script):
+    """
+    Runs the code in the current process, returns the exit code and what was written
+    to stdout and stderr.
+    """
+    import contextlib
+    import io
+    import traceback
+
+    returncode = 0
+    stdout = io.StringIO()
+    stderr = io.StringIO()
+    argv, sys_path = sys.argv, list(sys.path)
+    with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+        try:
+            exec(code_obj, main_globals(path, is_script))
+        except SystemExit as e:
+            if e.code is not None and e.code != 0:
+                returncode = e.code if isinstance(e.code, int) else 1
+        except Exception:
+            traceback.print_exc()
+            returncode = 1
+        finally:
+            sys.argv, sys.path[:] = argv, sys_path
+    return returncode, stdout.getvalue(), stderr.getvalue()
+
+
+# Directory used to cache the python code converted from each notebook
+NBCONVERT_CACHE = ".nbconvert_cache"
+
+_EXPORTERS = {}
+
+
+def get_exporter(exclude_markdown=False):
+    """
+    Returns an nbconvert exporter that converts notebooks to python. The exporters
+    are created once and reused, so that their templates are only loaded once.
+    """
+    if exclude_markdown not in _EXPORTERS:
+        import nbconvert
+        from traitlets.config import Config
+
+        c = Config()
+        c.TemplateExporter.exclude_markdown = exclude_markdown
+        _EXPORTERS[exclude_markdown] = nbconvert.exporters.PythonExporter(config=c)
+    return _EXPORTERS[exclude_markdown]
+
+
+def convert_notebook(path):
+    """
+    Converts a notebook to python code. The code is cached in NBCONVERT_CACHE, keyed
+    by the path and modification time of the notebook and the nbconvert version, so
+    that notebooks which have not changed since the last run are not converted
+    again.
+    """
+    import hashlib
     import nbconvert
-    import pybamm
 
-    b = pybamm.Timer()
-    print("Test " + path + " ... ", end="")
-    sys.stdout.flush()
+    key = "{}:{}:{}".format(
+        os.path.abspath(path), os.stat(path).st_mtime_ns, nbconvert.__version__
+    )
+    cache_path = os.path.join(
+        NBCONVERT_CACHE, hashlib.blake2b(key.encode()).hexdigest() + ".py"
+    )
+    try:
+        with open(cache_path, "r", encoding="utf-8", newline="") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+
+    code, __ = get_exporter().from_filename(path)
+
+    # Write to a temporary file first, so that an interrupted run cannot leave a
+    # partially written file in the cache
+    os.makedirs(NBCONVERT_CACHE, exist_ok=True)
+    tmp_path = cache_path + "." + str(os.getpid())
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        f.write(code)
+    os.replace(tmp_path, cache_path)
+    return code
 
+
+def file_contains(path, text):
+    """
+    Returns True if the file contains the given bytes, or a match of the given
+    compiled bytes pattern. The file is memory mapped rather than read into a string,
+    as notebooks with embedded images can be large.
+    """
+    import mmap
+
+    with open(path, "rb") as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                if isinstance(text, bytes):
+                    return mm.find(text) != -1
+                return text.search(mm) is not None
+        except ValueError:
+            # empty files cannot be memory mapped
+            return False
+
+
+def notebook_code(path):
+    """
+    Returns the python code to run to test a notebook.
+    """
+    code = convert_notebook(path)
+
+    # Remove coding statement, if present, and the "%pip install pybamm -q" command
+    return _PIP_INSTALL_RE.sub("", _CODING_RE.sub("", code))
+
+
+async def test_notebook(path, semaphore, executable="python"):
+    """
+    Tests a single notebook, returns a function that prints the result and returns
+    True if the notebook ran successfully. As for scripts, notebooks are run in the
+    pool of worker processes if the executable is this python, otherwise the
+    converted code is run with the executable in a subprocess.
+    """
     # Make sure the notebook has a "%pip install pybamm -q" command, for using Google
     # Colab
-    with open(path, "r") as f:
-        if "%pip install pybamm -q" not in f.read():
+    has_pip_install = file_contains(path, b"%pip install pybamm -q")
+    if not has_pip_install:
+
+        def report():
+            print("Test " + path + " ... ", end="")
             # print error and exit
             print("\n" + "-" * 70)
             print("ERROR")
@@ -189,95 +746,112 @@ def test_notebook(path, executable="python"):
             print("-" * 70)
             return False
 
-    # Load notebook, convert to python
-    e = nbconvert.exporters.PythonExporter()
-    code, __ = e.from_filename(path)
+        return report
 
-    # Remove coding statement, if present
-    code = "\n".join([x for x in code.splitlines() if x[:9] != "# coding"])
+    # Notebooks without code cells have nothing to run, so skip converting them
+    if not file_contains(path, _CODE_CELL_RE):
 
-    # Tell matplotlib not to produce any figures
-    env = dict(os.environ)
-    env["MPLBACKEND"] = "Template"
+        def report():
+            print("Test " + path + " ... ok (no code cells)")
+            return True
 
-    # If notebook makes use of magic commands then
-    # the script must be ran using ipython
-    # https://github.com/jupyter/nbconvert/issues/503#issuecomment-269527834
-    executable = (
-        "ipython"
-        if (("run_cell_magic(" in code) or ("run_line_magic(" in code))
-        else executable
-    )
+        return report
 
-    # Run in subprocess
-    cmd = [executable] + ["-c", code]
+    # Convert to python and run in the worker pool
+    if runs_in_pool(executable):
+        result = await submit(exec_example, path, True)
+        return lambda: report_test(path, *result)
+
+    # Otherwise convert in the worker pool, and run the code in a subprocess
     try:
-        p = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
-        )
-        stdout, stderr = p.communicate()
-        # TODO: Use p.communicate(timeout=3600) if Python3 only
-        if p.returncode != 0:
-            # Show failing code, output and errors before returning
-            print("ERROR")
-            print("-- script " + "-" * (79 - 10))
-            for i, line in enumerate(code.splitlines()):
-                j = str(1 + i)
-                print(j + " " * (5 - len(j)) + line)
-            print("-- stdout " + "-" * (79 - 10))
-            print(str(stdout, "utf-8"))
-            print("-- stderr " + "-" * (79 - 10))
-            print(str(stderr, "utf-8"))
-            print("-" * 79)
-            return False
-    except KeyboardInterrupt:
-        p.terminate()
-        print("ABORTED")
-        sys.exit(1)
+        code = await submit(notebook_code, path)
+    except Exception:
+        import traceback
 
-    # Sucessfully run
-    print("ok (" + b.format() + ")")
-    return True
+        error = traceback.format_exc()
+        return lambda: report_test(path, 1, "", error, 0)
 
+    if uses_magic(code):
+        executable = "ipython"
+    result = await run_subprocess([executable, "-c", code], semaphore)
+    return lambda: report_test(path, *result, code)
 
-def test_script(path, executable="python"):
+
+async def test_script(path, semaphore, executable="python"):
     """
-    Tests a single notebook, exists if it doesn't finish.
+    Tests a single script, returns a function that prints the result and returns
+    True if the script ran successfully. Scripts are run in the same pool of worker
+    processes as the notebooks if the executable is this python (see
+    `runs_in_pool`); otherwise a subprocess is started.
     """
-    import pybamm
+    if runs_in_pool(executable):
+        result = await submit(exec_example, path)
+    else:
+        result = await run_subprocess([executable, path], semaphore)
+    return lambda: report_test(path, *result)
 
-    b = pybamm.Timer()
-    print("Test " + path + " ... ", end="")
-    sys.stdout.flush()
+
+async def run_subprocess(cmd, semaphore):
+    """
+    Runs a command in a subprocess, once the semaphore allows it, and returns the
+    exit code, what was written to stdout and stderr, and the time taken.
+    """
+    import asyncio
+    import tempfile
+    from pybamm import Timer
 
     # Tell matplotlib not to produce any figures
     env = dict(os.environ)
     env["MPLBACKEND"] = "Template"
 
-    # Run in subprocess
-    cmd = [executable] + [path]
-    try:
-        p = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env
-        )
-        stdout, stderr = p.communicate()
-        # TODO: Use p.communicate(timeout=3600) if Python3 only
-        if p.returncode != 0:
-            # Show failing code, output and errors before returning
-            print("ERROR")
-            print("-- stdout " + "-" * (79 - 10))
-            print(str(stdout, "utf-8"))
-            print("-- stderr " + "-" * (79 - 10))
-            print(str(stderr, "utf-8"))
-            print("-" * 79)
-            return False
-    except KeyboardInterrupt:
-        p.terminate()
-        print("ABORTED")
-        sys.exit(1)
+    # Output is written straight to temporary files rather than piped back and
+    # buffered in memory, as it is only needed if the test fails
+    async with semaphore:
+        with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            b = Timer()
+            p = await asyncio.create_subprocess_exec(
+                *resolve_command(cmd),
+                stdout=stdout,
+                stderr=stderr,
+                env=env,
+                close_fds=False,
+            )
+            try:
+                await asyncio.wait_for(p.wait(), EXAMPLE_TIMEOUT)
+            except asyncio.TimeoutError:
+                p.kill()
+                await p.wait()
+                write_timed_out(stderr)
+            return (p.returncode,) + read_output(p.returncode, stdout, stderr) + (
+                b.time(),
+            )
+
+
+def report_test(path, returncode, stdout, stderr, time, code=None):
+    """
+    Prints the result of running a notebook or script, returns True if it ran
+    successfully. If the code that was run is given, it is printed on failure.
+    """
+    from pybamm import Timer
+
+    print("Test " + path + " ... ", end="")
+    if returncode != 0:
+        # Show failing code, output and errors before returning
+        print("ERROR")
+        if code is not None:
+            print("-- script " + "-" * (79 - 10))
+            for i, line in enumerate(code.splitlines()):
+                j = str(1 + i)
+                print(j + " " * (5 - len(j)) + line)
+        print("-- stdout " + "-" * (79 - 10))
+        print(stdout)
+        print("-- stderr " + "-" * (79 - 10))
+        print(stderr)
+        print("-" * 79)
+        return False
 
     # Sucessfully run
-    print("ok (" + b.format() + ")")
+    print("ok (" + Timer().format(time) + ")")
     return True
 
 
@@ -285,29 +859,44 @@ def export_notebook(ipath, opath):
     """
     Exports the notebook at `ipath` to a python file at `opath`.
     """
-    import nbconvert
-    from traitlets.config import Config
-
-    # Create nbconvert configuration to ignore text cells
-    c = Config()
-    c.TemplateExporter.exclude_markdown = True
-
-    # Load notebook, convert to python
-    e = nbconvert.exporters.PythonExporter(config=c)
-    code, __ = e.from_filename(ipath)
+    # Load notebook, convert to python, ignoring text cells
+    code, __ = get_exporter(exclude_markdown=True).from_filename(ipath)
 
     # Remove "In [1]:" comments
-    r = re.compile(r"(\s*)# In\[([^]]*)\]:(\s)*")
-    code = r.sub("\n\n", code)
+    code = _IN_CELL_RE.sub("\n\n", code)
 
-    # Store as executable script file
-    with open(opath, "w") as f:
-        f.write("#!/usr/bin/env python")
-        f.write(code)
-    os.chmod(opath, 0o775)
+    # Store as executable script file. The mode is set on the open descriptor, so it
+    # also applies when overwriting an existing file and is not masked by the umask
+    data = ("#!/usr/bin/env python" + code).encode("utf-8")
+    fd = os.open(opath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o775)
+    try:
+        if hasattr(os, "fchmod"):
+            os.fchmod(fd, 0o775)
+        os.write(fd, data)
+    finally:
+        os.close(fd)
+    if not hasattr(os, "fchmod"):
+        os.chmod(opath, 0o775)
 
 
 if __name__ == "__main__":
+    # The single flag invocations used by CI are dispatched directly, without
+    # setting up the argument parser
+    fast_paths = {
+        "--unit": lambda: run_code_tests(True, "unit"),
+        "--nosub": lambda: run_code_tests(folder="unit"),
+        "--flake8": run_flake8,
+        "--lint": run_lint,
+        "--doctest": run_doc_tests,
+        "--examples": lambda: run_notebook_and_scripts(True),
+        "--allexamples": run_notebook_and_scripts,
+    }
+    if len(sys.argv) == 2 and sys.argv[1] in fast_paths:
+        fast_paths[sys.argv[1]]()
+        sys.exit()
+
+    import argparse
+
     # Set up argument parsing
     parser = argparse.ArgumentParser(
         description="Run unit tests for PyBaMM.",
@@ -343,16 +932,29 @@ if __name__ == "__main__":
         action="store_true",
         help="Test all Jupyter notebooks and scripts in `examples`.",
     )
+    parser.add_argument(
+        "--shard",
+        type=shard_spec,
+        default=None,
+        metavar="i/n",
+        help="Only test the i-th of n shards of the notebooks and scripts (from 0).",
+    )
     parser.add_argument(
         "-debook",
         nargs=2,
         metavar=("in", "out"),
         help="Export a Jupyter notebook to a Python file for manual testing.",
     )
-    # Doctests
+    # Style checks
     parser.add_argument(
         "--flake8", action="store_true", help="Run flake8 to check for style issues"
     )
+    parser.add_argument(
+        "--lint",
+        action="store_true",
+        help="Run a quick, less complete, style check with ruff (or flake8, if ruff is "
+        "not installed)",
+    )
     # Doctests
     parser.add_argument(
         "--doctest",
@@ -380,10 +982,13 @@ if __name__ == "__main__":
     if args.nosub:
         has_run = True
         run_code_tests(folder=folder)
-    # Flake8
+    # Style checks
     if args.flake8:
         has_run = True
         run_flake8()
+    if args.lint:
+        has_run = True
+        run_lint()
     # Doctests
     if args.doctest:
         has_run = True
@@ -391,10 +996,10 @@ if __name__ == "__main__":
     # Notebook tests
     if args.allexamples:
         has_run = True
-        run_notebook_and_scripts()
+        run_notebook_and_scripts(shard=args.shard)
     elif args.examples:
         has_run = True
-        run_notebook_and_scripts(True)
+        run_notebook_and_scripts(True, shard=args.shard)
     if args.debook:
         has_run = True
         export_notebook(*args.debook)
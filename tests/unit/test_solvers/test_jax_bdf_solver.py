@@ -4,6 +4,8 @@ from tests import get_mesh_for_testing
 import sys
 import time
 import numpy as np
+import scipy.linalg
+from unittest import mock
 from platform import system
 if system() != "Windows":
     import jax
@@ -95,6 +97,85 @@ class TestJaxBDFSolver(unittest.TestCase):
         np.testing.assert_allclose(y[:, 0], np.exp(0.05 * t_eval),
                                    rtol=1e-7, atol=1e-7)
 
+    def test_mass_matrix_non_diagonal(self):
+        # M dy/dt = -y, which has the exact solution y = expm(-M^-1 t) y0
+        t_eval = np.linspace(0.0, 1.0, 80)
+
+        def fun(y, t):
+            return -y
+
+        mass = np.array([
+            [2.0, 1.0],
+            [1.0, 3.0],
+        ])
+        y0 = np.array([1.0, 2.0])
+
+        y = pybamm.jax_bdf_integrate(fun, y0, t_eval, mass=mass, rtol=1e-8, atol=1e-8)
+
+        # test accuracy
+        A = -np.linalg.inv(mass)
+        soln = np.stack([scipy.linalg.expm(A * t) @ y0 for t in t_eval])
+        np.testing.assert_allclose(y, soln, rtol=1e-6, atol=1e-6)
+
+    def test_solver_batched(self):
+        # Solve
+        t_eval = np.linspace(0.0, 1.0, 80)
+
+        def fun(y, t):
+            return -0.1 * y
+
+        y0 = np.array([[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+        y = pybamm.jax_bdf_integrate_batched(fun, y0, t_eval, rtol=1e-8, atol=1e-8)
+        self.assertEqual(y.shape, (3, 80, 2))
+
+        # test against the unbatched solver and the exact solution
+        for i in range(y0.shape[0]):
+            y_i = pybamm.jax_bdf_integrate(fun, y0[i], t_eval, rtol=1e-8, atol=1e-8)
+            np.testing.assert_allclose(y[i], y_i)
+            np.testing.assert_allclose(y[i], np.outer(np.exp(-0.1 * t_eval), y0[i]),
+                                       rtol=1e-6, atol=1e-6)
+
+    def test_solver_jac_sparsity(self):
+        # Solve tridiagonal (diffusion-like) system
+        t_eval = np.linspace(0.0, 1.0, 80)
+        n = 20
+        A = (
+            np.diag(-2.0 * np.ones(n))
+            + np.diag(np.ones(n - 1), 1)
+            + np.diag(np.ones(n - 1), -1)
+        )
+
+        def fun(y, t):
+            return jax.numpy.dot(A, y)
+
+        y0 = np.linspace(1.0, 2.0, n)
+        y = pybamm.jax_bdf_integrate(fun, y0, t_eval, rtol=1e-8, atol=1e-8)
+        y_sparse = pybamm.jax_bdf_integrate(fun, y0, t_eval, rtol=1e-8, atol=1e-8,
+                                            jac_sparsity=A != 0)
+
+        np.testing.assert_allclose(y_sparse, y)
+
+    def test_solver_jac_sparsity_compiled_once(self):
+        t_eval = np.linspace(0.0, 1.0, 20)
+        n = 10
+        A = np.diag(-np.ones(n)) + np.diag(np.ones(n - 1), 1)
+
+        def fun(y, t):
+            return jax.numpy.dot(A, y)
+
+        y0 = np.ones(n)
+        bdf = pybamm.solvers.jax_bdf_solver
+        with mock.patch.object(
+            bdf, "_sparse_jacfwd", wraps=bdf._sparse_jacfwd
+        ) as sparse_jacfwd:
+            for _ in range(2):
+                # a new, but equal, sparsity pattern each time
+                pybamm.jax_bdf_integrate(fun, y0, t_eval, jac_sparsity=A != 0)
+
+        # the jacobian is only set up when the solver is compiled, which should only
+        # happen once
+        self.assertEqual(sparse_jacfwd.call_count, 1)
+
     def test_solver_sensitivities(self):
         # Create model
         model = pybamm.BaseModel()
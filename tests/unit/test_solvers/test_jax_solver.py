@@ -268,6 +268,36 @@ class TestJaxSolver(unittest.TestCase):
         np.testing.assert_allclose(y[0], np.exp(-0.2 * t_eval),
                                    rtol=1e-6, atol=1e-6)
 
+    def test_get_solve_new_t_eval(self):
+        # Create model
+        model = pybamm.BaseModel()
+        model.convert_to_format = "jax"
+        domain = ["negative electrode", "separator", "positive electrode"]
+        var = pybamm.Variable("var", domain=domain)
+        model.rhs = {var: -pybamm.InputParameter("rate") * var}
+        model.initial_conditions = {var: 1}
+
+        # create discretisation
+        mesh = get_mesh_for_testing()
+        spatial_methods = {"macroscale": pybamm.FiniteVolume()}
+        disc = pybamm.Discretisation(mesh, spatial_methods)
+        disc.process_model(model)
+
+        for method in ['RK45', 'BDF']:
+            solver = pybamm.JaxSolver(method=method, rtol=1e-8, atol=1e-8)
+            t_eval = np.linspace(0, 5, 80)
+            solver.solve(model, t_eval, inputs={"rate": 0.1})
+
+            # the cached solve is reused with different output times
+            for t_eval in [np.linspace(0, 2, 80), np.linspace(0, 5, 40)]:
+                y = solver.get_solve(model, t_eval)({"rate": 0.1})
+                np.testing.assert_allclose(y[0], np.exp(-0.1 * t_eval),
+                                           rtol=1e-6, atol=1e-6)
+
+                solution = solver.solve(model, t_eval, inputs={"rate": 0.1})
+                np.testing.assert_allclose(solution.y[0], np.exp(-0.1 * t_eval),
+                                           rtol=1e-6, atol=1e-6)
+
 
 if __name__ == "__main__":
     print("Add -v for more debug output")